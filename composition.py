@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+#
+# composition.py
+#
+# Calculate the composition-dependent strategy of Easy Blackjack: the best
+# move for every multiset of player cards (not just its total) in a finite
+# shoe
+#
+
+from array import array
+
+from easybj import DEALER_CODE, DISTINCT, draw, hand_state, make_rules, make_shoe
+
+# moves stored in the strategy bytes (same names as Calculator.strategy)
+MOVE_CODE = ['S', 'H', 'Dh', 'Ds', 'Rh', 'Rs']
+
+# index of each dealer final total in a dealer distribution (0 is bust)
+FINAL_INDEX = {17: 0, 18: 1, 19: 2, 20: 3, 21: 4, 0: 5}
+
+# point value of every distinct card (aces count 1)
+POINTS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+#
+# Returns the distribution of the dealer's final total (indexed by
+# FINAL_INDEX) for every dealer code when cards are drawn with probs
+# (h17: whether the dealer hits a soft 17)
+#
+def dealer_finals(probs, h17=True):
+    memo = {}
+
+    def finals(total, soft):
+        if total == 0 or total >= 18 or (total == 17 and not (soft and h17)):
+            result = [0.]*6
+            result[FINAL_INDEX[total]] = 1.
+            return result
+        key = (total, soft)
+        if key not in memo:
+            result = [0.]*6
+            for card, p in zip(DISTINCT, probs):
+                if p > 0:
+                    for k, q in enumerate(finals(*draw(total, soft, card))):
+                        result[k] += p*q
+            memo[key] = result
+        return memo[key]
+
+    return [finals(*hand_state(dc)) for dc in DEALER_CODE]
+
+# ev of standing on total against a dealer distribution
+def stand_value(total, finals):
+    ev = finals[FINAL_INDEX[0]]
+    for final, k in FINAL_INDEX.items():
+        if final == 0:
+            continue
+        if total > final:
+            ev += finals[k]
+        elif total < final:
+            ev -= finals[k]
+    return ev
+
+#
+# Composition-dependent strategy for every reachable player hand of two or
+# more cards against every dealer code, for a shoe of decks
+#
+# Hands are canonicalized to their count of each DISTINCT value, so every
+# permutation of the same cards is one node. A node's hit and double values
+# are built from its children (one more card), so shared subtrees are
+# evaluated exactly once; only a few small arrays per node are kept.
+#
+# rules: dictionary of changes to easybj.DEFAULT_RULES (the blackjack
+#        payout and das only matter to the split tables and the advantage)
+#
+# Note: only the player's cards are removed from the shoe (the strategy is
+# indexed by dealer code like Calculator.strategy), and splits are left to
+# the split tables.
+#
+class CompositionStrategy:
+    def __init__(self, decks, rules=None):
+        self.shoe = make_shoe(decks)
+        self.rules = make_rules(rules)
+        # canonical count tuple of every node, and its index
+        self.nodes = []
+        self.index = {}
+        # per node, per dealer code (row-major): ev of standing, ev of the
+        # best of standing and hitting, the best move (index in MOVE_CODE)
+        # and its ev
+        self.stand = array('d')
+        self.value = array('d')
+        self.moves = bytearray()
+        self.best = array('d')
+
+    # enumerate every hand of two or more cards with a hard total <= 21
+    def make_nodes(self):
+        counts = [0]*len(DISTINCT)
+
+        def visit(rank, hard, cards):
+            if rank == len(DISTINCT):
+                if cards >= 2:
+                    self.index[tuple(counts)] = len(self.nodes)
+                    self.nodes.append(tuple(counts))
+                return
+            most = min(self.shoe[rank], (21 - hard) // POINTS[rank])
+            for k in range(most + 1):
+                counts[rank] = k
+                visit(rank + 1, hard + k*POINTS[rank], cards + k)
+            counts[rank] = 0
+
+        visit(0, 0, 0)
+
+    # best total and softness of a node
+    def total(self, counts):
+        hard = sum(k*v for k, v in zip(counts, POINTS))
+        if counts[0] and hard + 10 <= 21:
+            return hard + 10, True
+        return hard, False
+
+    #
+    # Evaluates every node against every dealer code, children (more points)
+    # before parents
+    #
+    def make_tables(self):
+        width = len(DEALER_CODE)
+        self.stand = array('d', [0.])*(len(self.nodes)*width)
+        self.value = array('d', [0.])*(len(self.nodes)*width)
+        self.moves = bytearray(len(self.nodes)*width)
+        self.best = array('d', [0.])*(len(self.nodes)*width)
+        order = sorted(range(len(self.nodes)),
+            key=lambda i: -sum(k*v for k, v in zip(self.nodes[i], POINTS)))
+        for i in order:
+            counts = self.nodes[i]
+            left = sum(self.shoe) - sum(counts)
+            probs = [(n - k) / left for n, k in zip(self.shoe, counts)]
+            total = self.total(counts)[0]
+            stand = [stand_value(total, finals)
+                for finals in dealer_finals(probs, self.rules['h17'])]
+            self.stand[i*width:(i + 1)*width] = array('d', stand)
+            if total == 21:
+                self.value[i*width:(i + 1)*width] = array('d', stand)
+                self.best[i*width:(i + 1)*width] = array('d', stand)
+                continue
+
+            # sum over the next card of the best child values (bust loses)
+            hit = [0.]*width
+            double = [0.]*width
+            for rank, p in enumerate(probs):
+                if p == 0:
+                    continue
+                child = list(counts)
+                child[rank] += 1
+                j = self.index.get(tuple(child))
+                for x in range(width):
+                    if j is None:
+                        hit[x] -= p
+                        double[x] -= 2*p
+                    else:
+                        hit[x] += p*self.value[j*width + x]
+                        double[x] += 2*p*self.stand[j*width + x]
+
+            two_cards = sum(counts) == 2
+            for x in range(width):
+                evs = [stand[x], hit[x]]
+                if two_cards:
+                    evs.append(double[x])
+                    if self.rules['surrender'] is not None:
+                        evs.append(self.rules['surrender'])
+                move = 'SHDR'[evs.index(max(evs))]
+                if move in 'DR':
+                    move += 'h' if stand[x] < hit[x] else 's'
+                self.value[i*width + x] = max(stand[x], hit[x])
+                self.moves[i*width + x] = MOVE_CODE.index(move)
+                self.best[i*width + x] = max(evs)
+
+    # canonical count tuple of a list of cards (J, Q, K count as T)
+    def canonical(self, cards):
+        counts = [0]*len(DISTINCT)
+        for card in cards:
+            counts[DISTINCT.index(card if card not in 'JQK' else 'T')] += 1
+        return tuple(counts)
+
+    #
+    # Returns the best move (see MOVE_CODE) of the player's cards against a
+    # dealer code
+    #
+    def lookup(self, cards, dealer):
+        i = self.index.get(self.canonical(cards))
+        if i is None:
+            raise KeyError("%s is not a reachable hand"%''.join(cards))
+        return MOVE_CODE[self.moves[i*len(DEALER_CODE) + DEALER_CODE.index(dealer)]]
+
+    #
+    # Returns the ev of the best move (the move returned by lookup) of the
+    # player's cards against a dealer code
+    #
+    def ev(self, cards, dealer):
+        i = self.index.get(self.canonical(cards))
+        if i is None:
+            raise KeyError("%s is not a reachable hand"%''.join(cards))
+        return self.best[i*len(DEALER_CODE) + DEALER_CODE.index(dealer)]
+
+#
+# Calculate the composition-dependent strategy for a shoe of decks
+#
+def calculate(decks, rules=None):
+    strategy = CompositionStrategy(decks, rules)
+    strategy.make_nodes()
+    strategy.make_tables()
+    return strategy
+
+
+if __name__ == "__main__":
+    strategy = calculate(1)
+    print("%d hands"%len(strategy.nodes))
+    for cards in (['T', '6'], ['4', '8', '4'], ['3', '3', 'T'], ['2', '4', 'T']):
+        print("%s vs 10: %s"%(''.join(cards), strategy.lookup(cards, '10')))
@@ -7,6 +7,10 @@
 
 from table import Table
 from collections import defaultdict
+import copy
+import hashlib
+import os
+import pickle
 #from numpy import inf
 
 # code names for all the hard hands
@@ -35,6 +39,29 @@ DEALER_CODE = HARD_CODE + SOFT_CODE[:6]
 # (hard 4 is always 22, and hard 20 is always TT)
 INITIAL_CODE = HARD_CODE[1:-1] + SPLIT_CODE + SOFT_CODE[1:] + ['BJ']
 
+# default rules of Easy Blackjack
+#
+# surrender: ev of surrendering (None if surrender is not allowed)
+# blackjack: payout of a player blackjack
+# das: whether a hand may double after a split
+# h17: whether the dealer hits a soft 17
+#
+DEFAULT_RULES = {'surrender': -0.5, 'blackjack': 1.5, 'das': True, 'h17': True}
+
+# rules that change the dealer tables and everything after them
+DEALER_RULES = ['h17']
+
+# rules that change the split tables and everything after them
+SPLIT_RULES = ['das']
+
+# returns the default rules updated by rules (a dictionary of changes)
+def make_rules(rules=None):
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    for name in rules:
+        if name not in DEFAULT_RULES:
+            raise KeyError("%s is not a rule"%name)
+    return rules
+
 # 
 # Returns whether a and b are close enough in floating point value
 # Note: use this to debug your code
@@ -137,13 +164,165 @@ class Hand:
     def remove_card(self):
         self.cards.pop()
 
+#
+# Returns the total and softness of a hand after drawing card
+# (a busted hand has total BUST)
+#
+def draw(total, soft, card):
+    hard = total - 10 if soft else total
+    if card == 'A':
+        hard += 1
+    elif card == 'T':
+        hard += 10
+    else:
+        hard += int(card)
+    if hard > 21:
+        return BUST, False
+    if (soft or card == 'A') and hard + 10 <= 21:
+        return hard + 10, True
+    return hard, False
+
+# the code which represents a hand that can no longer be split
+def hand_code(total, soft):
+    if soft and total < 21:
+        return SOFT_CODE[total - 12]
+    return str(total)
+
+# the total and softness of the hand represented by a non-split code
+def hand_state(code):
+    if code in SOFT_CODE:
+        return 11 + (1 if code[1] == 'A' else int(code[1])), True
+    return int(code), False
+
+# net result in bets of a hand against the dealer's final total
+def settle(total, mult, dealer):
+    if total == BUST:
+        return -mult
+    if dealer == BUST or total > dealer:
+        return mult
+    if total < dealer:
+        return -mult
+    return 0
+
+# number of cards of each distinct value in a single deck
+DECK = [4]*9 + [4*NUM_FACES]
+
+# return the number of cards of each distinct value in a shoe of decks
+def make_shoe(decks):
+    return [n*decks for n in DECK]
+
+# return the probability of drawing each DISTINCT card from a shoe (None for
+# an infinite deck)
+def draw_probs(shoe=None):
+    if shoe is None:
+        return [probability(c) for c in DISTINCT]
+    return [n / sum(shoe) for n in shoe]
+
+#
+# Returns the (first, second) DISTINCT index pairs of every two-card hand
+# grouped by the code of the hand
+#
+def group_two_cards(dealer=False):
+    groups = defaultdict(list)
+    for i, x in enumerate(DISTINCT):
+        for j, y in enumerate(DISTINCT):
+            hand = Hand(x, y, dealer)
+            hand.calculate_value()
+            groups[hand.code()].append((i, j))
+    return dict(groups)
+
+# two-card hands grouped by code for the player and the dealer
+PLAYER_PAIRS = group_two_cards()
+DEALER_PAIRS = group_two_cards(dealer=True)
+
+#
+# Returns the initial probability table
+#
+# shoe: number of cards of each DISTINCT value left in the shoe (see
+#       make_shoe), or None for an infinite deck
+#
+# With an infinite deck the table is the outer product of the dealer and
+# player code probabilities. With a shoe the dealer cards are removed before
+# the player code probabilities are summed, so the table is exact for
+# dealing without replacement.
+#
+def initial_table(shoe=None):
+    table = Table(float, DEALER_CODE + ['BJ'], INITIAL_CODE, unit='%')
+    cells = defaultdict(float)
+    if shoe is None:
+        probs = [probability(c) for c in DISTINCT]
+        player = {pc: sum(probs[i]*probs[j] for i, j in pairs)
+            for pc, pairs in PLAYER_PAIRS.items()}
+        for dc, pairs in DEALER_PAIRS.items():
+            dp = sum(probs[i]*probs[j] for i, j in pairs)
+            for pc, pp in player.items():
+                cells[pc,dc] += dp*pp
+    else:
+        counts = list(shoe)
+        total = sum(counts)
+        if len(counts) != len(DISTINCT) or min(counts) < 0 or total < 4:
+            raise ValueError("shoe must hold at least 4 cards in %d counts"%len(DISTINCT))
+        for dc, pairs in DEALER_PAIRS.items():
+            for i, j in pairs:
+                dp = counts[i] / total
+                counts[i] -= 1
+                dp *= counts[j] / (total - 1)
+                counts[j] -= 1
+                if dp > 0:
+                    for pc, ppairs in PLAYER_PAIRS.items():
+                        pp = sum(counts[x]*(counts[y] - (x == y)) for x, y in ppairs)
+                        cells[pc,dc] += dp*pp / ((total - 2)*(total - 3))
+                counts[i] += 1
+                counts[j] += 1
+    for dc in table.xlabels:
+        for pc in table.ylabels:
+            table[pc,dc] = float(cells[pc,dc])
+    return table
+
+#
+# Returns the best ev and its move (S, H, Dh, Ds, P, Rh or Rs) of a list of
+# the evs of standing, hitting, doubling, splitting and surrendering
+#
+def best_move(ev_list):
+    max_ev = max(ev_list)
+    max_ev_id = ev_list.index(max_ev)
+
+    if max_ev_id == 0:
+        move = 'S'
+    elif max_ev_id == 1:
+        move = 'H'    
+    elif max_ev_id == 2:
+        move = "D"
+        if ev_list[0] < ev_list[1]:
+            move += "h"
+        else:
+            move += "s"
+    elif max_ev_id == 3:
+        move = 'P'
+    elif max_ev_id == 4:
+        move = "R"
+        if ev_list[0] < ev_list[1]:
+            move += "h"
+        else:
+            move += "s"
+    return max_ev, move
+
 #
 # Singleton class to store all the results. 
 #
 # Note: you should make HUGE changes to this class
 #
+#
+# shoe: number of cards of each DISTINCT value left in the shoe (see
+#       make_shoe), or None for an infinite deck. Cards are drawn with the
+#       shoe's probabilities; only the initial table removes dealt cards.
+# rules: dictionary of changes to DEFAULT_RULES
+#
 class Calculator:
-    def __init__(self): 
+    def __init__(self, shoe=None, rules=None): 
+        self.shoe = shoe
+        self.rules = make_rules(rules)
+        self.probs = draw_probs(shoe)
         self.initprob = Table(float, DEALER_CODE + ['BJ'], INITIAL_CODE, unit='%')
         self.dealprob = defaultdict(dict)
         self.stand_ev = Table(float, DEALER_CODE, STAND_CODE)
@@ -157,31 +336,10 @@ class Calculator:
             Table(float, DEALER_CODE, SPLIT_CODE[:-1]), 
             Table(float, DEALER_CODE, SPLIT_CODE[:-1])] 
     
-    # make each cell of the initial probability table      
-    def make_initial_cell(self, player, dealer):
-        table = self.initprob
-        dc = dealer.code()  
-        pc = player.code()
-        prob = dealer.probability() * player.probability()
-        if table[pc,dc] is None:
-            table[pc,dc] = prob
-        else:
-            table[pc,dc] += prob
-    
-    # make the initial probability table            
+    # make the initial probability table (exact for the calculator's shoe,
+    # see initial_table)
     def make_initial_table(self):
-        #
-        # TODO: refactor so that other table building functions can use it
-        #
-        for i in DISTINCT:
-            for j in DISTINCT:
-                for x in DISTINCT:
-                    for y in DISTINCT:
-                        dealer = Hand(i, j, dealer=True)
-                        player = Hand(x, y)
-                        dealer.calculate_value()
-                        player.calculate_value()
-                        self.make_initial_cell(player, dealer)
+        self.initprob = initial_table(self.shoe)
     
     # verify sum of initial table is close to 1    
     def verify_initial_table(self):
@@ -206,13 +364,9 @@ class Calculator:
                 temp_hand = Hand(DISTINCT[table_index + 4 - int((table_index + 4)/2)-1], DISTINCT[int((table_index + 4)/2)-1], False)
             temp_hand.calculate_value()
             
-            #Looping through all of the possible cards (A-K)
-            for card in range(1,14):
-                #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-                if card > 10:
-                    card_index = 9
-                else:
-                    card_index = card - 1
+            #Looping through all of the distinct cards (A-T)
+            for card_index in range(len(DISTINCT)):
+                p = self.probs[card_index]
 
                 #Add the new card that we are considering and calculate its value
                 temp_hand.add_card(DISTINCT[card_index])
@@ -221,7 +375,7 @@ class Calculator:
                 #The new hand hand has not busted
                 if temp_hand.value < 21 and temp_hand.value != 0:
                     #If it is a soft hand that the dealer can have then get the values for the new hand
-                    if temp_hand.soft and temp_hand.value <= 17:
+                    if temp_hand.soft and (temp_hand.value < 17 or (temp_hand.value == 17 and self.rules['h17'])):
                         temp_dict = self.make_dealer_tables_sub(temp_hand.value + 5)
                     
                     # if temp_hand.code in DEALER_CODE[17:]: #or temp_hand.soft:
@@ -231,20 +385,20 @@ class Calculator:
                         temp_dict = self.make_dealer_tables_sub(temp_hand.value - 4)
                     
                     if '17' in temp_dict:
-                        self.dealprob[DEALER_CODE[table_index]]['17'] += (1/13)*temp_dict['17']
+                        self.dealprob[DEALER_CODE[table_index]]['17'] += p*temp_dict['17']
                     if '18' in temp_dict:
-                        self.dealprob[DEALER_CODE[table_index]]['18'] += (1/13)*temp_dict['18']
+                        self.dealprob[DEALER_CODE[table_index]]['18'] += p*temp_dict['18']
                     if '19' in temp_dict:    
-                        self.dealprob[DEALER_CODE[table_index]]['19'] += (1/13)*temp_dict['19']
+                        self.dealprob[DEALER_CODE[table_index]]['19'] += p*temp_dict['19']
                     if '20' in temp_dict:
-                        self.dealprob[DEALER_CODE[table_index]]['20'] += (1/13)*temp_dict['20']
+                        self.dealprob[DEALER_CODE[table_index]]['20'] += p*temp_dict['20']
                     if '21' in temp_dict:
-                        self.dealprob[DEALER_CODE[table_index]]['21'] += (1/13)*temp_dict['21']
-                        # self.dealprob[HARD_CODE[table_index]]['0'] += (1/13)*temp_dict['0']
+                        self.dealprob[DEALER_CODE[table_index]]['21'] += p*temp_dict['21']
+                        # self.dealprob[HARD_CODE[table_index]]['0'] += p*temp_dict['0']
                 elif temp_hand.value == 21:
-                    self.dealprob[DEALER_CODE[table_index]]['21'] += (1/13)
+                    self.dealprob[DEALER_CODE[table_index]]['21'] += p
                 # else:
-                #     self.dealprob[HARD_CODE[table_index]]['0'] += (1/13)
+                #     self.dealprob[HARD_CODE[table_index]]['0'] += p
                 temp_hand.remove_card()
                 
             # self.dealprob[HARD_CODE[table_index]]['0'] = 0
@@ -257,6 +411,9 @@ class Calculator:
         #Intialize the dealer tables: 17-20 are initialized to 1 and the rest are empty
         for i in HARD_CODE[13:]:
             self.dealprob[i] = {i:1}
+        #A standing dealer treats soft 17 like hard 17
+        if not self.rules['h17']:
+            self.dealprob['A6'] = {'17':1}
 
         #Creating the dealer tables: 4-16
         for i in range(12, 2, -1):
@@ -308,21 +465,17 @@ class Calculator:
             player_hand = Hand(DISTINCT[0], DISTINCT[int(player_value - 11 - 1)], False)
         player_hand.can_split = False
         
-        for card in range(1,14):
-            #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-            if card > 10:
-                card_index = 9
-            else:
-                card_index = card - 1
+        for card_index in range(len(DISTINCT)):
+            p = self.probs[card_index]
 
             #Add the new card that we are considering and calculate its value
             player_hand.add_card(DISTINCT[card_index])
             player_hand.calculate_value()
 
             if player_hand.value != 0:
-                expected_value += 2*(1/13)*self.make_stand_table_helper(player_hand.code(), dealer_hand_str)
+                expected_value += 2*p*self.make_stand_table_helper(player_hand.code(), dealer_hand_str)
             else :
-                expected_value -= 2*(1/13)
+                expected_value -= 2*p
             player_hand.remove_card()
 
         return expected_value
@@ -343,12 +496,8 @@ class Calculator:
                 player_hand = Hand(DISTINCT[0], DISTINCT[int(player_value - 11 - 1)], False)
             player_hand.can_split = False
 
-            for card in range(1,14):
-                #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-                if card > 10:
-                    card_index = 9
-                else:
-                    card_index = card - 1
+            for card_index in range(len(DISTINCT)):
+                p = self.probs[card_index]
 
                 #Add the new card that we are considering and calculate its value
                 player_hand.add_card(DISTINCT[card_index])
@@ -358,13 +507,13 @@ class Calculator:
                     stand_value = self.make_stand_table_helper(player_hand.code(), dealer_hand_str)
                     hit_value = self.make_hit_table_helper(player_hand.code(), dealer_hand_str)
                     if stand_value >= hit_value:
-                        expected_value += (1/13)*stand_value
+                        expected_value += p*stand_value
                     else:
-                        expected_value += (1/13)*hit_value
+                        expected_value += p*hit_value
                 elif player_hand.value == 21:
-                    expected_value += (1/13)*self.make_stand_table_helper(player_hand.code(), dealer_hand_str)
+                    expected_value += p*self.make_stand_table_helper(player_hand.code(), dealer_hand_str)
                 else :
-                    expected_value -= (1/13)
+                    expected_value -= p
                 player_hand.remove_card()
         else:
             return self.hit_ev.__getitem__((player_hand_str, dealer_hand_str))
@@ -393,8 +542,9 @@ class Calculator:
                 else:
                     hit_value = self.hit_ev.__getitem__((j,i))
                     stand_value = self.stand_ev.__getitem__((j,i))
-                    double_value = self.double_ev.__getitem__((j,i))
-                    list_of_values = [hit_value, stand_value, double_value]
+                    list_of_values = [hit_value, stand_value]
+                    if self.rules['das']:
+                        list_of_values.append(self.double_ev.__getitem__((j,i)))
                     max_value = max(list_of_values)
 
                 self.resplit_list[0].__setitem__((j,i), max_value)
@@ -402,18 +552,11 @@ class Calculator:
 
     def make_split1_table_helper(self, player_hand_str, dealer_hand_str):
         expected_value = 0
-        for card1 in range(1,14):
-            if card1 > 10:
-                card_index1 = 9
-            else:
-                card_index1 = card1 - 1
+        for card_index1 in range(len(DISTINCT)):
+            p1 = self.probs[card_index1]
 
-            for card2 in range(1,14):
-                #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-                if card2 > 10:
-                    card_index2 = 9
-                else:
-                    card_index2 = card2 - 1
+            for card_index2 in range(len(DISTINCT)):
+                p2 = self.probs[card_index2]
  
                 player_hand1 = Hand(player_hand_str[0], DISTINCT[card_index1], False)
                 player_hand2 = Hand(player_hand_str[0], DISTINCT[card_index2], False)
@@ -423,14 +566,14 @@ class Calculator:
                 player_hand2.can_split = False
                 
                 if player_hand1.value != 0 and player_hand2.value != 0:
-                    expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
+                    expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
                         + self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)))
                 elif player_hand1.value != 0:
-                    expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))-1/13)
+                    expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str)) - 1)
                 elif player_hand2.value != 0:
-                    expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str))-1/13)
+                    expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)) - 1)
                 else:
-                    expected_value -= (1/13)*(1/13)
+                    expected_value -= p1*p2
 
         return expected_value
 
@@ -441,18 +584,11 @@ class Calculator:
 
     def make_split2_table_helper(self, player_hand_str, dealer_hand_str):
         expected_value = 0
-        for card1 in range(1,14):
-            if card1 > 10:
-                card_index1 = 9
-            else:
-                card_index1 = card1 - 1
+        for card_index1 in range(len(DISTINCT)):
+            p1 = self.probs[card_index1]
 
-            for card2 in range(1,14):
-                #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-                if card2 > 10:
-                    card_index2 = 9
-                else:
-                    card_index2 = card2 - 1
+            for card_index2 in range(len(DISTINCT)):
+                p2 = self.probs[card_index2]
  
                 player_hand1 = Hand(player_hand_str[0], DISTINCT[card_index1], False)
                 player_hand2 = Hand(player_hand_str[0], DISTINCT[card_index2], False)
@@ -464,41 +600,41 @@ class Calculator:
                     #Case 1A: where hand1 is able to split regardless of hand2
                     if player_hand1.code() in SPLIT_CODE:
                         player_hand2.can_split = False
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str))
+                        expected_value += p1*p2*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str))
                         + self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)))
                     #Case 1B: where hand2 is able to split and hand1 is not
                     elif player_hand2.code() in SPLIT_CODE:
                         player_hand1.can_split = False
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
+                        expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
                         + self.resplit_list[1].__getitem__((player_hand2.code(), dealer_hand_str)))
                     #Case 1C: where neither can split
                     else:
                         player_hand1.can_split = False
                         player_hand2.can_split = False
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
+                        expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
                         + self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)))
                 
                 #Case 2:hand2 has busted
                 elif player_hand1.value != 0:
                     #Case 2A: hand2 can split
                     if player_hand1.code() in SPLIT_CODE:
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str))-1/13)    
+                        expected_value += p1*p2*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str)) - 1)    
                     #Case 2B: hand2 cannot split
                     else:
                         player_hand1.can_split = False
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))-1/13)
+                        expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str)) - 1)
                 
                 #Case 3:hand1 has busted
                 elif player_hand2.value != 0:
                     #Case 3A: hand2 can split
                     if player_hand2.code() in SPLIT_CODE:
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[1].__getitem__((player_hand2.code(), dealer_hand_str))-1/13)
+                        expected_value += p1*p2*(self.resplit_list[1].__getitem__((player_hand2.code(), dealer_hand_str)) - 1)
                     #Case 3B: hand2 cannot split
                     else:
                         player_hand2.can_split = False
-                        expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str))-1/13)
+                        expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)) - 1)
                 else:
-                    expected_value -= (1/13)*(1/13)
+                    expected_value -= p1*p2
 
         return expected_value
 
@@ -509,18 +645,11 @@ class Calculator:
 
     def make_split3_table_helper(self, player_hand_str, dealer_hand_str):
         expected_value = 0
-        for card1 in range(1,14):
-            if card1 > 10:
-                card_index1 = 9
-            else:
-                card_index1 = card1 - 1
+        for card_index1 in range(len(DISTINCT)):
+            p1 = self.probs[card_index1]
 
-            for card2 in range(1,14):
-                #If the card is J, Q, K consider it as a 10 to reference the card in the distinct list
-                if card2 > 10:
-                    card_index2 = 9
-                else:
-                    card_index2 = card2 - 1
+            for card_index2 in range(len(DISTINCT)):
+                p2 = self.probs[card_index2]
  
                 player_hand1 = Hand(player_hand_str[0], DISTINCT[card_index1], False)
                 player_hand2 = Hand(player_hand_str[0], DISTINCT[card_index2], False)
@@ -530,54 +659,54 @@ class Calculator:
                 if player_hand_str[0] == 'A':
                     player_hand1.can_split = False
                     player_hand2.can_split = False
-                    expected_value += (1/13)*(1/13)*(self.stand_ev.__getitem__((player_hand1.code(), dealer_hand_str))
+                    expected_value += p1*p2*(self.stand_ev.__getitem__((player_hand1.code(), dealer_hand_str))
                         + self.stand_ev.__getitem__((player_hand2.code(), dealer_hand_str)))
                 else:
                     #Case 1: both values do not bust
                     if player_hand1.value != 0 and player_hand2.value != 0:
                         #Case 1A: both hands can be split
                         if player_hand1.code() in SPLIT_CODE and player_hand2.code() in SPLIT_CODE:
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str))
+                            expected_value += p1*p2*(self.resplit_list[1].__getitem__((player_hand1.code(), dealer_hand_str))
                             + self.resplit_list[1].__getitem__((player_hand2.code(), dealer_hand_str)))
                             
                         #Case 1B: where hand1 is able to split and hand2 is not
                         elif player_hand1.code() in SPLIT_CODE:
                             player_hand2.can_split = False
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[2].__getitem__((player_hand1.code(), dealer_hand_str))
+                            expected_value += p1*p2*(self.resplit_list[2].__getitem__((player_hand1.code(), dealer_hand_str))
                             + self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)))
                         #Case 1C: where hand2 is able to split and hand1 is not
                         elif player_hand2.code() in SPLIT_CODE:
                             player_hand1.can_split = False
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
+                            expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
                             + self.resplit_list[2].__getitem__((player_hand2.code(), dealer_hand_str)))
                         #Case 1D: where neither can split
                         else:
                             player_hand1.can_split = False
                             player_hand2.can_split = False
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
+                            expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))
                             + self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)))
                     
                     #Case 2:hand2 has busted
                     elif player_hand1.value != 0:
                         #Case 2A: hand2 can split
                         if player_hand1.code() in SPLIT_CODE:
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[2].__getitem__((player_hand1.code(), dealer_hand_str))-1/13)    
+                            expected_value += p1*p2*(self.resplit_list[2].__getitem__((player_hand1.code(), dealer_hand_str)) - 1)    
                         #Case 2B: hand2 cannot split
                         else:
                             player_hand1.can_split = False
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str))-1/13)
+                            expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand1.code(), dealer_hand_str)) - 1)
                     
                     #Case 3:hand1 has busted
                     elif player_hand2.value != 0:
                         #Case 3A: hand2 can split
                         if player_hand2.code() in SPLIT_CODE:
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[2].__getitem__((player_hand2.code(), dealer_hand_str))-1/13)
+                            expected_value += p1*p2*(self.resplit_list[2].__getitem__((player_hand2.code(), dealer_hand_str)) - 1)
                         #Case 3B: hand2 cannot split
                         else:
                             player_hand2.can_split = False
-                            expected_value += (1/13)*(1/13)*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str))-1/13)
+                            expected_value += p1*p2*(self.resplit_list[0].__getitem__((player_hand2.code(), dealer_hand_str)) - 1)
                     else:
-                        expected_value -= (1/13)*(1/13)
+                        expected_value -= p1*p2
 
         return expected_value
 
@@ -586,60 +715,46 @@ class Calculator:
             for j in SPLIT_CODE:
                 self.split_ev.__setitem__((j,i), self.make_split3_table_helper(j,i))
 
+    #
+    # Returns the ev of standing, hitting, doubling and splitting player
+    # code j against dealer code i (-inf if the move is not possible)
+    #
+    def move_evs(self, j, i):
+        if j in self.split_ev.ylabels and i in self.split_ev.xlabels:
+            split_ev = self.split_ev.__getitem__((j,i))
+        else:
+            split_ev = -1*float('inf')
+        
+        if j in SPLIT_CODE:
+            temp_hand = Hand(j[0], j[1], False)
+            temp_hand.calculate_value()
+            temp_hand.can_split = False
+            j = temp_hand.code()
+            
+        if j in self.stand_ev.ylabels and i in self.stand_ev.xlabels:
+            stand_ev = self.stand_ev.__getitem__((j,i))
+        else:
+            stand_ev = -1*float('inf')
+        if j in self.hit_ev.ylabels and i in self.hit_ev.xlabels:
+            hit_ev = self.hit_ev.__getitem__((j,i))
+        else:
+            hit_ev = -1*float('inf')
+        if j in self.double_ev.ylabels and i in self.double_ev.xlabels:
+            double_ev = self.double_ev.__getitem__((j,i))
+        else:
+            double_ev = -1*float('inf')
+        return [stand_ev, hit_ev, double_ev, split_ev]
+
     def make_optimal_table(self):
+        surrender_ev = self.rules['surrender']
+        if surrender_ev is None:
+            surrender_ev = -1*float('inf')
         for i in DEALER_CODE:
             for j in PLAYER_CODE:
-                f = j
-                if j in self.split_ev.ylabels and i in self.split_ev.xlabels:
-                    split_ev = self.split_ev.__getitem__((j,i))
-                else:
-                    split_ev = -1*float('inf')
-                
-                if j in SPLIT_CODE:
-                    temp_hand = Hand(j[0], j[1], False)
-                    temp_hand.calculate_value()
-                    temp_hand.can_split = False
-                    j = temp_hand.code()
-                    
-                if j in self.stand_ev.ylabels and i in self.stand_ev.xlabels:
-                    stand_ev = self.stand_ev.__getitem__((j,i))
-                else:
-                    stand_ev = -1*float('inf')
-                if j in self.hit_ev.ylabels and i in self.hit_ev.xlabels:
-                    hit_ev = self.hit_ev.__getitem__((j,i))
-                else:
-                    hit_ev = -1*float('inf')
-                if j in self.double_ev.ylabels and i in self.double_ev.xlabels:
-                    double_ev = self.double_ev.__getitem__((j,i))
-                else:
-                    double_ev = -1*float('inf')
-                
-                surrender_ev = -0.5
-                ev_list = [stand_ev, hit_ev, double_ev, split_ev, surrender_ev]
-                max_ev = max(ev_list)
-                self.optimal_ev.__setitem__((f,i), max_ev)
-
-                max_ev_id = ev_list.index(max_ev)
-
-                if max_ev_id == 0:
-                    move = 'S'
-                elif max_ev_id == 1:
-                    move = 'H'    
-                elif max_ev_id == 2:
-                    move = "D"
-                    if ev_list[0] < ev_list[1]:
-                        move += "h"
-                    else:
-                        move += "s"
-                elif max_ev_id == 3:
-                    move = 'P'
-                elif max_ev_id == 4:
-                    move = "R"
-                    if ev_list[0] < ev_list[1]:
-                        move += "h"
-                    else:
-                        move += "s"
-                self.strategy.__setitem__((f,i), move)
+                ev_list = self.move_evs(j, i) + [surrender_ev]
+                max_ev, move = best_move(ev_list)
+                self.optimal_ev.__setitem__((j,i), max_ev)
+                self.strategy.__setitem__((j,i), move)
 
     def calculate_advantage(self):
         for i in self.initprob.xlabels:
@@ -649,45 +764,181 @@ class Calculator:
                 elif i == 'BJ' and j != 'BJ':
                     self.advantage -= self.initprob.__getitem__((j,i))
                 elif j == 'BJ' and i != 'BJ':
-                    self.advantage += self.initprob.__getitem__((j,i))*1.5
+                    self.advantage += self.initprob.__getitem__((j,i))*self.rules['blackjack']
                 else:
                     self.advantage += self.initprob.__getitem__((j,i))*self.optimal_ev.__getitem__((j,i))
-           
+
+    # all the ev tables and the final strategy table in a dictionary
+    def results(self):
+        return {
+            'initial' : self.initprob,
+            'dealer' : self.dealprob,
+            'stand' : self.stand_ev,
+            'hit' : self.hit_ev,
+            'double' : self.double_ev,
+            'split' : self.split_ev,
+            'optimal' : self.optimal_ev,
+            'strategy' : self.strategy,
+            'advantage' : self.advantage,
+            'resplit' : self.resplit_list,
+        }
+
+# Calculator methods that build all the results, in order (each stage only
+# reads tables made by the stages before it)
+STAGES = [
+    'make_initial_table',
+    'verify_initial_table',
+    'make_dealer_tables',
+    'make_stand_table',
+    'make_double_table',
+    'make_hit_table',
+    'make_split0_table',
+    'make_split1_table',
+    'make_split2_table',
+    'make_split3_table',
+    'make_optimal_table',
+    'calculate_advantage',
+]
+
+# file written by snapshot.py with the results of calculate()
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'easybj.snapshot')
+
+# the game constants every result depends on
+RULES = (tuple(DISTINCT), NUM_FACES, NUM_RANKS, tuple(DEALER_CODE), tuple(PLAYER_CODE),
+    tuple(sorted(DEFAULT_RULES.items())))
+
+#
+# Returns a fingerprint of the code that computes the results, so that a
+# snapshot goes stale as soon as easybj.py or table.py is edited
+#
+def engine_version():
+    digest = hashlib.sha256()
+    for name in ('easybj.py', 'table.py'):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+#
+# Returns the pickled results stored in the snapshot, or None if there is no
+# snapshot, it was built for other rules or another engine version, or its
+# body does not match the digest in its header
+#
+# Note: any error reading a damaged snapshot counts as a stale one, so that
+# importing easybj never fails because of it
+#
+def load_snapshot(path=SNAPSHOT_PATH):
+    try:
+        with open(path, 'rb') as f:
+            version, rules, digest = pickle.load(f)
+            body = f.read()
+        if (version, rules) != (engine_version(), RULES):
+            return None
+        if hashlib.sha256(body).hexdigest() != digest:
+            return None
+        return body
+    except Exception:
+        return None
+
+# snapshot loaded at import time (unpickled again on every calculate(), and
+# dropped if it turns out to be damaged)
+_snapshot = load_snapshot()
+
 # Calculate all the ev tables and the final strategy table and return them
 # all in a dictionary
+#
+# snapshot: return the precomputed results of snapshot.py when they match
+# the current rules and engine version
+# shoe: cards of each DISTINCT value left in the shoe (None for an infinite
+#       deck, the only case covered by the snapshot)
+# rules: dictionary of changes to DEFAULT_RULES (the snapshot only covers
+#        the default rules)
 #      
-def calculate():
-    calc = Calculator()   
-    
-    calc.make_initial_table()
-    
-    # TODO: uncomment once you finished your table implementation
-    #       and Hand.code implementation
-    calc.verify_initial_table()
-    
-    # TODO: calculate all other tables and numbers
-    calc.make_dealer_tables()
-    calc.make_stand_table()
-    calc.make_double_table()
-    calc.make_hit_table()
-    calc.make_split0_table()
-    calc.make_split1_table()
-    calc.make_split2_table()
-    calc.make_split3_table()
-    calc.make_optimal_table()
-    calc.calculate_advantage()
-    
-    
+def calculate(snapshot=True, shoe=None, rules=None):
+    global _snapshot
+    if snapshot and shoe is None and not rules and _snapshot is not None:
+        try:
+            return pickle.loads(_snapshot)
+        except Exception:
+            # a damaged snapshot is dropped and the results recomputed
+            _snapshot = None
+
+    calc = Calculator(shoe, rules)   
+    for stage in STAGES:
+        getattr(calc, stage)()
+    return calc.results()
+
+# stages shared by every variant with the same dealer rules
+DEALER_STAGES = STAGES[:STAGES.index('make_split0_table')]
+
+# stages shared by every variant with the same dealer and split rules
+SPLIT_STAGES = STAGES[STAGES.index('make_split0_table'):STAGES.index('make_optimal_table')]
+
+#
+# Calculate the optimal ev, strategy and advantage of many rule variants
+# together and return them stacked in a dictionary
+#
+# variants: list of dictionaries of changes to DEFAULT_RULES
+# shoe: same as calculate
+#
+# The dealer, stand, hit and double tables only depend on the dealer rules
+# (h17) and the split tables also on das, so each of those stages runs once
+# per distinct value rather than once per variant. The payout rules
+# (surrender, blackjack) are applied to every variant of a group in a single
+# pass over the cells. 'optimal' and 'strategy' are tables whose cells are
+# lists with one entry per variant, and 'advantage' is a list.
+#
+def calculate_batch(variants, shoe=None):
+    variants = [make_rules(rules) for rules in variants]
+    optimal = Table(list, DEALER_CODE, PLAYER_CODE)
+    strategy = Table(list, DEALER_CODE, PLAYER_CODE)
+    for i in DEALER_CODE:
+        for j in PLAYER_CODE:
+            optimal[j,i] = [None]*len(variants)
+            strategy[j,i] = [None]*len(variants)
+    advantage = [0]*len(variants)
+
+    groups = defaultdict(lambda: defaultdict(list))
+    for k, rules in enumerate(variants):
+        dealer_key = tuple(rules[name] for name in DEALER_RULES)
+        split_key = tuple(rules[name] for name in SPLIT_RULES)
+        groups[dealer_key][split_key].append(k)
+
+    for dealer_key, split_groups in groups.items():
+        base = Calculator(shoe, dict(zip(DEALER_RULES, dealer_key)))
+        for stage in DEALER_STAGES:
+            getattr(base, stage)()
+        for split_key, members in split_groups.items():
+            calc = copy.deepcopy(base)
+            calc.rules.update(zip(SPLIT_RULES, split_key))
+            for stage in SPLIT_STAGES:
+                getattr(calc, stage)()
+
+            surrender = [variants[k]['surrender'] for k in members]
+            surrender = [-1*float('inf') if ev is None else ev for ev in surrender]
+            blackjack = [variants[k]['blackjack'] for k in members]
+            for i in DEALER_CODE:
+                for j in PLAYER_CODE:
+                    ev_list = calc.move_evs(j, i)
+                    p = 0
+                    if j in calc.initprob.ylabels:
+                        p = calc.initprob.__getitem__((j,i))
+                    cell_ev = optimal[j,i]
+                    cell_move = strategy[j,i]
+                    for k, surrender_ev in zip(members, surrender):
+                        cell_ev[k], cell_move[k] = best_move(ev_list + [surrender_ev])
+                        advantage[k] += p*cell_ev[k]
+            for k, payout in zip(members, blackjack):
+                for i in calc.initprob.xlabels:
+                    p = calc.initprob.__getitem__(('BJ',i))
+                    if i != 'BJ':
+                        advantage[k] += p*payout
+                for j in calc.initprob.ylabels:
+                    if j != 'BJ':
+                        advantage[k] -= calc.initprob.__getitem__((j,'BJ'))
+
     return {
-        'initial' : calc.initprob,
-        'dealer' : calc.dealprob,
-        'stand' : calc.stand_ev,
-        'hit' : calc.hit_ev,
-        'double' : calc.double_ev,
-        'split' : calc.split_ev,
-        'optimal' : calc.optimal_ev,
-        'strategy' : calc.strategy,
-        'advantage' : calc.advantage,
-        'resplit' : calc.resplit_list,
+        'variants' : variants,
+        'optimal' : optimal,
+        'strategy' : strategy,
+        'advantage' : advantage,
     }
-
@@ -0,0 +1,462 @@
+#!/usr/bin/python3
+#
+# gametree.py
+#
+# Export the decision graph of a round of Easy Blackjack (deals, player
+# moves, card draws, dealer play and payouts) as a deduplicated DAG in
+# compact array form for external solvers
+#
+
+import hashlib
+import json
+import os
+from array import array
+from collections import deque
+
+from easybj import (BUST, DISTINCT, SPLIT_CODE, draw, hand_state, initial_table, make_rules,
+    probability, settle)
+
+# node kinds: a DECISION takes the best edge, CHANCE and SUM nodes take the
+# weighted sum of their edges (CHANCE weights are probabilities, SUM weights
+# count hands played), a TERMINAL is worth its value
+DECISION, CHANCE, SUM, TERMINAL = 0, 1, 2, 3
+
+# moves labelling the edges of decision nodes (chance and sum edges use -1)
+ACTIONS = 'SHDRP'
+
+# nodes and edges are written to disk once this many are buffered
+FLUSH_SIZE = 1 << 16
+
+# bytes of the digest that stands for a key in the index (collisions are
+# negligible at 128 bits)
+DIGEST_SIZE = 16
+
+#
+# Writes the graph as flat binary arrays in a directory:
+#
+# nodes.kind (uint8), nodes.value (float64), nodes.label (one per line)
+# edges.indptr (int64, edges of node i are indptr[i]:indptr[i+1])
+# edges.target (int64), edges.weight (float64), edges.action (int8)
+# graph.json (counts, root and the meaning of every file)
+#
+class GraphWriter:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.files = {name: open(os.path.join(path, name), 'wb') for name in
+            ('nodes.kind', 'nodes.value', 'edges.indptr', 'edges.target',
+            'edges.weight', 'edges.action')}
+        self.labels = open(os.path.join(path, 'nodes.label'), 'w')
+        self.nodes = 0
+        self.edges = 0
+        self.new_buffers()
+        self.buffers['edges.indptr'].append(0)
+
+    # "private" member function to start empty buffers
+    def new_buffers(self):
+        self.buffers = {
+            'nodes.kind' : array('B'),
+            'nodes.value' : array('d'),
+            'edges.indptr' : array('q'),
+            'edges.target' : array('q'),
+            'edges.weight' : array('d'),
+            'edges.action' : array('b'),
+        }
+        self.pending = []
+
+    # appends node (ids must be written in order) and its edges
+    def add_node(self, kind, value, label, edges):
+        self.buffers['nodes.kind'].append(kind)
+        self.buffers['nodes.value'].append(value)
+        self.pending.append(label)
+        for target, weight, action in edges:
+            self.buffers['edges.target'].append(target)
+            self.buffers['edges.weight'].append(weight)
+            self.buffers['edges.action'].append(action)
+        self.nodes += 1
+        self.edges += len(edges)
+        self.buffers['edges.indptr'].append(self.edges)
+        if len(self.buffers['edges.target']) >= FLUSH_SIZE or len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for name, buffer in self.buffers.items():
+            buffer.tofile(self.files[name])
+        self.labels.write(''.join(label + '\n' for label in self.pending))
+        self.new_buffers()
+
+    #
+    # order: if edge targets were written as provisional ids, the id every
+    #        provisional id was written as (edges.target is rewritten in place)
+    #
+    def close(self, root=0, order=None):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.labels.close()
+        if order is not None:
+            self.renumber(order)
+        with open(os.path.join(self.path, 'graph.json'), 'w') as f:
+            json.dump({
+                'nodes' : self.nodes,
+                'edges' : self.edges,
+                'root' : root,
+                'kinds' : ['decision', 'chance', 'sum', 'terminal'],
+                'actions' : ACTIONS,
+            }, f, indent=1)
+
+    # "private" member function to map every edge target through order
+    def renumber(self, order):
+        with open(os.path.join(self.path, 'edges.target'), 'r+b') as f:
+            while True:
+                start = f.tell()
+                chunk = array('q')
+                chunk.frombytes(f.read(FLUSH_SIZE*chunk.itemsize))
+                if not chunk:
+                    break
+                f.seek(start)
+                array('q', (order[t] for t in chunk)).tofile(f)
+
+#
+# Builds the graph one layer (number of cards removed from the shoe) at a
+# time: every node is identified by a key, a key seen again reuses its node,
+# and nodes are written in the order they are expanded
+#
+# Edges only lead to keys with at least as many removed cards, so once a
+# layer is expanded its index (a fixed-size digest of every key) is dropped
+# and only the layers being expanded or discovered are kept in memory. A key
+# reached again through a reshuffle after its layer was dropped becomes a
+# new node (with the same value). Edges are written with the id a key got
+# when it was discovered and renumbered once the graph is complete.
+#
+# shoe: number of cards of each DISTINCT value in the shoe, or None for an
+#       infinite deck (with a shoe every key carries the removed cards)
+# rules: dictionary of changes to easybj.DEFAULT_RULES
+#
+# Note: with a shoe the hands of a split draw from the shoe left after both
+# of their second cards, not after each other's later draws.
+#
+class GameTree:
+    def __init__(self, shoe=None, rules=None):
+        self.shoe = None if shoe is None else tuple(shoe)
+        self.rules = make_rules(rules)
+        # provisional id of every key (by its digest) by layer (None for keys
+        # kept for the whole export)
+        self.ids = {}
+        # queued (key, provisional id) pairs of every layer
+        self.queues = {}
+        # written id of every provisional id (-1 until written)
+        self.order = array('q')
+        # layer being expanded
+        self.current = None
+
+    # probability of drawing each DISTINCT card after the removed cards
+    def probs(self, removed):
+        if removed is None:
+            return [probability(c) for c in DISTINCT]
+        left = sum(self.shoe) - sum(removed)
+        return [(n - k) / left for n, k in zip(self.shoe, removed)]
+
+    # removed cards after also removing card (index into DISTINCT); the shoe
+    # is reshuffled once its last card is dealt
+    def remove(self, removed, card):
+        if removed is None:
+            return None
+        removed = list(removed)
+        removed[card] += 1
+        if sum(removed) == sum(self.shoe):
+            return (0,)*len(DISTINCT)
+        return tuple(removed)
+
+    # number of removed cards of a key (None for terminals and the root)
+    def layer(self, key):
+        kind = key[0]
+        if kind in ('end', 'root'):
+            return None
+        if kind == 'sum':
+            layers = [l for l in (self.layer(key[1]), self.layer(key[2])) if l is not None]
+            return max(layers) if layers else None
+        removed = key[-1]
+        return 0 if removed is None else sum(removed)
+
+    # "private" member function to find (or create) the provisional id of a key
+    def _id(self, key):
+        layer = self.layer(key)
+        index = self.ids.setdefault(layer, {})
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=DIGEST_SIZE).digest()
+        if digest not in index:
+            index[digest] = len(self.order)
+            self.order.append(-1)
+            self.queues.setdefault(layer, deque()).append((key, index[digest]))
+        return index[digest]
+
+    #
+    # "private" member function to dequeue the next (key, provisional id):
+    # keys kept for the whole export first, then the lowest layer (the index
+    # of every layer below it is dropped)
+    #
+    def _next(self):
+        if None in self.queues:
+            layer = None
+        else:
+            layer = min(self.queues)
+            if layer != self.current:
+                for l in [l for l in self.ids if l is not None and l < layer]:
+                    del self.ids[l]
+                self.current = layer
+        queue = self.queues[layer]
+        item = queue.popleft()
+        if not queue:
+            del self.queues[layer]
+        return item
+
+    # key of standing on total (a dealer that already stands pays out)
+    def stand_key(self, total, mult, dealer, removed):
+        dealer_total, dealer_soft = dealer
+        if dealer_total == BUST or dealer_total >= 18 or (dealer_total == 17 and
+                not (dealer_soft and self.rules['h17'])):
+            return ('end', float(settle(total, mult, dealer_total)))
+        return ('stand', total, mult, dealer, removed)
+
+    # key of a hand after drawing to total ('hit', 'split' or 'first' moves)
+    def hand_key(self, total, soft, moves, dealer, removed):
+        if total == BUST:
+            return ('end', -1.)
+        if total == 21:
+            return self.stand_key(21, 1, dealer, removed)
+        return ('decide', total, soft, moves, None, dealer, removed)
+
+    #
+    # Returns the kind, value and edges [(key, weight, action)] of a key
+    #
+    def expand(self, key):
+        kind = key[0]
+        if kind == 'end':
+            return TERMINAL, key[1], []
+        if kind == 'root':
+            return CHANCE, 0., self.expand_root()
+        if kind == 'decide':
+            return DECISION, 0., self.expand_decide(*key[1:])
+        if kind == 'sum':
+            if key[1] == key[2]:
+                return SUM, 0., [(key[1], 2., -1)]
+            return SUM, 0., [(key[1], 1., -1), (key[2], 1., -1)]
+
+        edges = []
+        if kind == 'stand':
+            total, mult, dealer, removed = key[1:]
+            for i, p in enumerate(self.probs(removed)):
+                if p > 0:
+                    new = draw(*dealer, DISTINCT[i])
+                    edges.append((self.stand_key(total, mult, new, self.remove(removed, i)), p, -1))
+        elif kind in ('hit', 'double'):
+            total, soft, dealer, removed = key[1:]
+            for i, p in enumerate(self.probs(removed)):
+                if p > 0:
+                    new_total, new_soft = draw(total, soft, DISTINCT[i])
+                    after = self.remove(removed, i)
+                    if kind == 'hit':
+                        target = self.hand_key(new_total, new_soft, 'SH', dealer, after)
+                    elif new_total == BUST:
+                        target = ('end', -2.)
+                    else:
+                        target = self.stand_key(new_total, 2, dealer, after)
+                    edges.append((target, p, -1))
+        elif kind == 'split':
+            edges = self.expand_split(*key[1:])
+        return CHANCE, 0., edges
+
+    # initial deals: blackjacks pay out, other hands go to their first move
+    def expand_root(self):
+        edges = []
+        if self.shoe is None:
+            table = initial_table()
+            for dc in table.xlabels:
+                for pc in table.ylabels:
+                    p = table[pc,dc]
+                    if dc == 'BJ':
+                        target = ('end', 0. if pc == 'BJ' else -1.)
+                    elif pc == 'BJ':
+                        target = ('end', float(self.rules['blackjack']))
+                    else:
+                        if pc in SPLIT_CODE:
+                            total, soft = draw(*draw(0, False, pc[0]), pc[1])
+                        else:
+                            total, soft = hand_state(pc)
+                        pair = pc[0] if pc in SPLIT_CODE else None
+                        target = ('decide', total, soft, self.first_moves(pair),
+                            pair, hand_state(dc), None)
+                    edges.append((target, p, -1))
+            return edges
+
+        # exact deal probabilities: dealer cards, then player cards
+        empty = (0,)*len(DISTINCT)
+        for d1, pd1 in enumerate(self.probs(empty)):
+            removed = self.remove(empty, d1)
+            for d2, pd2 in enumerate(self.probs(removed)):
+                dealt = self.remove(removed, d2)
+                dealer = draw(*draw(0, False, DISTINCT[d1]), DISTINCT[d2])
+                dealer_bj = dealer[0] == 21
+                for c1, pc1 in enumerate(self.probs(dealt)):
+                    after1 = self.remove(dealt, c1)
+                    for c2, pc2 in enumerate(self.probs(after1)):
+                        p = pd1*pd2*pc1*pc2
+                        if p == 0:
+                            continue
+                        total, soft = draw(*draw(0, False, DISTINCT[c1]), DISTINCT[c2])
+                        if dealer_bj:
+                            target = ('end', 0. if total == 21 else -1.)
+                        elif total == 21:
+                            target = ('end', float(self.rules['blackjack']))
+                        else:
+                            pair = DISTINCT[c1] if c1 == c2 else None
+                            target = ('decide', total, soft, self.first_moves(pair),
+                                pair, dealer, self.remove(after1, c2))
+                        edges.append((target, p, -1))
+        return edges
+
+    # moves of a hand on its first two cards (pair is the card of a pair)
+    def first_moves(self, pair):
+        moves = 'SHD'
+        if self.rules['surrender'] is not None:
+            moves += 'R'
+        if pair is not None:
+            moves += 'P'
+        return moves
+
+    # moves of a hand: stand, hit, double, surrender and split as allowed
+    def expand_decide(self, total, soft, moves, pair, dealer, removed):
+        edges = []
+        for move in moves:
+            if move == 'S':
+                target = self.stand_key(total, 1, dealer, removed)
+            elif move == 'H':
+                target = ('hit', total, soft, dealer, removed)
+            elif move == 'D':
+                target = ('double', total, soft, dealer, removed)
+            elif move == 'R':
+                target = ('end', float(self.rules['surrender']))
+            else:
+                target = ('split', pair, 3, dealer, removed)
+            edges.append((target, 1., ACTIONS.index(move)))
+        return edges
+
+    #
+    # Second cards of both hands of a split (level 3 is the first split; a
+    # pair at level 3 or 2 is resplit at a lower level, like
+    # Calculator.make_split3_table and make_split2_table)
+    #
+    def expand_split(self, card, level, dealer, removed):
+        edges = []
+        first = DISTINCT.index(card)
+        for c1, p1 in enumerate(self.probs(removed)):
+            after1 = self.remove(removed, c1)
+            for c2, p2 in enumerate(self.probs(after1)):
+                if p1*p2 == 0:
+                    continue
+                after = self.remove(after1, c2)
+                levels = [0, 0]
+                if card != 'A':
+                    if level == 3 and c1 == first and c2 == first:
+                        levels = [1, 1]
+                    elif level == 3 and c1 == first:
+                        levels = [2, 0]
+                    elif level == 3 and c2 == first:
+                        levels = [0, 2]
+                    elif level == 2 and c1 == first:
+                        levels = [1, 0]
+                    elif level == 2 and c2 == first:
+                        levels = [0, 1]
+                hands = []
+                for c, l in zip((c1, c2), levels):
+                    total, soft = draw(*draw(0, False, card), DISTINCT[c])
+                    if l:
+                        hands.append(('split', card, l, dealer, after))
+                    elif card == 'A':
+                        hands.append(self.stand_key(total, 1, dealer, after))
+                    else:
+                        hands.append(self.hand_key(total, soft, 'HSD' if self.rules['das'] else 'HS',
+                            dealer, after))
+                hands.sort(key=repr)
+                edges.append((('sum', hands[0], hands[1]), p1*p2, -1))
+        return edges
+
+    #
+    # Streams the whole graph to the directory path and returns the number
+    # of nodes and edges
+    #
+    def export(self, path):
+        writer = GraphWriter(path)
+        root = self._id(('root',))
+        while self.queues:
+            key, provisional = self._next()
+            self.order[provisional] = writer.nodes
+            kind, value, edges = self.expand(key)
+            # merge edges that lead to the same node
+            merged = {}
+            for target, weight, action in edges:
+                if (target, action) in merged:
+                    merged[target, action] += weight
+                else:
+                    merged[target, action] = weight
+            writer.add_node(kind, value, ' '.join(str(k) for k in key),
+                [(self._id(target), weight, action) for (target, action), weight in merged.items()])
+        writer.close(self.order[root], self.order)
+        return writer.nodes, writer.edges
+
+#
+# Loads a graph written by GameTree.export as a dictionary of arrays
+#
+def load(path):
+    with open(os.path.join(path, 'graph.json')) as f:
+        graph = json.load(f)
+    for name, code in (('nodes.kind', 'B'), ('nodes.value', 'd'), ('edges.indptr', 'q'),
+            ('edges.target', 'q'), ('edges.weight', 'd'), ('edges.action', 'b')):
+        data = array(code)
+        with open(os.path.join(path, name), 'rb') as f:
+            data.frombytes(f.read())
+        graph[name] = data
+    return graph
+
+#
+# Returns the value of every node of a loaded graph (decisions take their
+# best edge), e.g. the player advantage at the root
+#
+def solve(graph):
+    kind = graph['nodes.kind']
+    value = array('d', graph['nodes.value'])
+    indptr = graph['edges.indptr']
+    target = graph['edges.target']
+    weight = graph['edges.weight']
+    done = bytearray(len(kind))
+
+    # depth first, children before parents (the graph is acyclic)
+    for start in range(len(kind)):
+        stack = [start]
+        while stack:
+            node = stack[-1]
+            if done[node]:
+                stack.pop()
+                continue
+            children = [target[e] for e in range(indptr[node], indptr[node + 1])
+                if not done[target[e]]]
+            if children:
+                stack.extend(children)
+                continue
+            edges = range(indptr[node], indptr[node + 1])
+            if kind[node] == DECISION:
+                value[node] = max(weight[e]*value[target[e]] for e in edges)
+            elif kind[node] != TERMINAL:
+                value[node] = sum(weight[e]*value[target[e]] for e in edges)
+            done[node] = 1
+            stack.pop()
+    return value
+
+
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else 'gametree.out'
+    nodes, edges = GameTree().export(path)
+    print("wrote %d nodes and %d edges to %s"%(nodes, edges, path))
+    graph = load(path)
+    print("Player Advantage: %2.4f%%"%(solve(graph)[graph['root']]*100))
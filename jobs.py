@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+#
+# jobs.py
+#
+# Run long sweeps of the Easy Blackjack calculator as units of work that are
+# checkpointed to disk, so an interrupted sweep resumes where it stopped
+#
+
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from multiprocessing import Pool
+
+import easybj
+
+#
+# Directory of pickled values addressed by key (any value with a stable
+# repr, e.g. a string or a tuple of numbers)
+#
+# Every value is written to a temporary file and renamed into place, so a
+# crash never leaves a half-written checkpoint behind
+#
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    # "private" member function to find the file of a key
+    def _file(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.path, digest + '.pickle')
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def load(self, key):
+        with open(self._file(key), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, key, value):
+        name = self._file(key)
+        temp = '%s.%d.tmp'%(name, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, name)
+
+    def discard(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+#
+# Returns what a checkpoint of a unit is valid for: the engine version and
+# the unit's shoe and rules (a checkpoint made for anything else is stale)
+#
+def unit_inputs(shoe, rules):
+    shoe = None if shoe is None else tuple(shoe)
+    return easybj.engine_version(), shoe, tuple(sorted(easybj.make_rules(rules).items()))
+
+#
+# Returns the value saved under key for inputs, or None if there is none or
+# it was saved for other inputs
+#
+def load_unit(store, key, inputs):
+    if key not in store:
+        return None
+    saved_inputs, value = store.load(key)
+    if saved_inputs != inputs:
+        return None
+    return value
+
+#
+# Runs the calculator pipeline for one unit, saving the calculator after
+# every stage (dealer tables, resplit levels, ...) so that a restarted unit
+# skips the stages it already finished
+#
+# path: directory of the checkpoint store
+# key: key of the unit in the store
+# shoe: shoe composition of the unit (None for an infinite deck)
+# rules: dictionary of changes to easybj.DEFAULT_RULES
+#
+# Checkpoints saved for another shoe, other rules or another version of
+# the engine are recalculated.
+#
+def run_unit(path, key, shoe, rules=None):
+    store = Checkpoint(path)
+    inputs = unit_inputs(shoe, rules)
+    results = load_unit(store, key, inputs)
+    if results is not None:
+        return key, results
+    stage_key = ('stages', key)
+    calc = easybj.Calculator(shoe, rules)
+    done = 0
+    saved = load_unit(store, stage_key, inputs)
+    if saved is not None:
+        done, state = saved
+        calc.__dict__.update(state)
+    for i in range(done, len(easybj.STAGES)):
+        getattr(calc, easybj.STAGES[i])()
+        store.save(stage_key, (inputs, (i + 1, calc.__dict__)))
+    results = calc.results()
+    store.save(key, (inputs, results))
+    store.discard(stage_key)
+    return key, results
+
+# run_unit taking a single tuple (for Pool.imap_unordered)
+def run_unit_args(args):
+    return run_unit(*args)
+
+# default progress report: one status line rewritten on stderr
+def print_progress(done, total, rate, eta):
+    sys.stderr.write("\r%d/%d units  %.2f units/s  eta %s   "%(done, total, rate,
+        '-' if eta is None else '%ds'%eta))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+#
+# Runs units of work against a checkpoint store
+#
+# path: directory of the checkpoint store
+# report: function(done, total, rate, eta) called as units finish (rate is
+#         in units per second for this run, eta in seconds or None)
+#
+class Runner:
+    def __init__(self, path, report=print_progress):
+        self.store = Checkpoint(path)
+        self.report = report
+        self.cancelled = threading.Event()
+
+    #
+    # Asks a running run() to stop after the units in flight (safe to call
+    # from another thread or a signal handler)
+    #
+    def cancel(self):
+        self.cancelled.set()
+
+    #
+    # Calculates the results of every unit and returns them in a dictionary
+    # keyed like units; units finished by an earlier run are loaded instead
+    #
+    # units: dictionary of key to a (shoe, rules) pair, where shoe is a shoe
+    #        composition (None for an infinite deck) and rules a dictionary
+    #        of changes to easybj.DEFAULT_RULES (None for the defaults),
+    #        e.g. one entry per true count or per rule variant
+    # processes: size of the worker pool (1 runs in this process)
+    #
+    # After a cancel() or Ctrl-C only the finished units are returned (or
+    # saved, for Ctrl-C which is raised again); run() again to resume.
+    #
+    def run(self, units, processes=1):
+        self.cancelled.clear()
+        results = {}
+        pending = []
+        for key, (shoe, rules) in units.items():
+            value = load_unit(self.store, key, unit_inputs(shoe, rules))
+            if value is None:
+                pending.append((self.store.path, key, shoe, rules))
+            else:
+                results[key] = value
+        total = len(units)
+        start = time.time()
+        finished = 0
+
+        def progress():
+            elapsed = max(time.time() - start, 1e-9)
+            rate = finished / elapsed
+            eta = (total - len(results)) / rate if rate > 0 else None
+            if self.report is not None:
+                self.report(len(results), total, rate, eta)
+
+        progress()
+        if processes == 1:
+            for args in pending:
+                if self.cancelled.is_set():
+                    break
+                key, value = run_unit(*args)
+                results[key] = value
+                finished += 1
+                progress()
+            return results
+
+        pool = Pool(processes)
+        try:
+            for key, value in pool.imap_unordered(run_unit_args, pending):
+                results[key] = value
+                finished += 1
+                progress()
+                if self.cancelled.is_set():
+                    break
+        finally:
+            # stage checkpoints of units in flight survive the terminate
+            pool.terminate()
+            pool.join()
+        return results
+
+    # removes every checkpoint of units (to force them to be recalculated)
+    def reset(self, units):
+        for key in units:
+            self.store.discard(key)
+            self.store.discard(('stages', key))
+
+
+if __name__ == "__main__":
+    import signal
+    runner = Runner('checkpoints')
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.cancel())
+    units = {('decks', decks): (easybj.make_shoe(decks), None) for decks in range(1, 9)}
+    for (_, decks), results in sorted(runner.run(units).items()):
+        print("%d decks: Player Advantage: %2.4f%%"%(decks, results['advantage']*100))
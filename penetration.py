@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+#
+# penetration.py
+#
+# Sample the player advantage of Easy Blackjack as a shoe is dealt down
+#
+
+import math
+import random
+from multiprocessing import Pool
+
+import easybj
+from easybj import DECK, DISTINCT, make_shoe
+from table import Table
+
+# labels of the columns of the curve table
+CURVE_CODE = ['mean', 'sd', 'p05', 'p50', 'p95', '>0']
+
+# advantage of the full calculator pipeline for one remaining shoe
+def advantage(shoe):
+    return easybj.calculate(snapshot=False, shoe=list(shoe))['advantage']
+
+# returns the value at fraction q of sorted values
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q*len(values)))]
+
+#
+# Samples remaining shoe compositions at several penetrations and keeps the
+# advantage of every sample, so the curves can be refined by sampling again
+#
+# decks: number of decks in the full shoe
+# depths: fractions of the shoe already dealt (0 <= depth < 1)
+# method: 'exact' runs the calculator pipeline for every composition,
+#         'linear' uses effects of removal computed once from a single deck
+# seed: seed of the random number generator (for repeatable curves)
+#
+class Penetration:
+    def __init__(self, decks, depths, method='exact', seed=None):
+        if method not in ('exact', 'linear'):
+            raise ValueError("method must be 'exact' or 'linear'")
+        self.shoe = make_shoe(decks)
+        self.decks = decks
+        self.depths = tuple(depths)
+        self.method = method
+        self.rng = random.Random(seed)
+        total = sum(self.shoe)
+        for depth in self.depths:
+            if not 0 <= depth < 1 or total - round(depth*total) < 4:
+                raise ValueError("depth %s leaves too few cards in the shoe"%str(depth))
+        self.samples = {depth: [] for depth in self.depths}
+        # full-shoe advantage and per-card effects of removal ('linear')
+        self.base = None
+        self.removal = None
+        if method == 'linear':
+            self.make_removal_table()
+
+    #
+    # Effect on the advantage of removing one card of each value from a
+    # single deck (Griffin's effects of removal)
+    #
+    def make_removal_table(self):
+        self.base = advantage(self.shoe)
+        single = advantage(DECK)
+        self.removal = []
+        for i in range(len(DISTINCT)):
+            shoe = list(DECK)
+            shoe[i] -= 1
+            self.removal.append(advantage(shoe) - single)
+
+    # linear estimate of the advantage of a remaining shoe
+    def estimate(self, shoe):
+        remaining = sum(shoe)
+        full = sum(self.shoe)
+        shift = 0.
+        for eor, n, m in zip(self.removal, self.shoe, shoe):
+            # cards of this value removed beyond a proportional share
+            shift += eor*(n*remaining/full - m)
+        return self.base + shift*sum(DECK)/remaining
+
+    # remaining composition after dealing cards at random from the full shoe
+    def deal_down(self, cards):
+        deck = [i for i, n in enumerate(self.shoe) for _ in range(n)]
+        shoe = list(self.shoe)
+        for i in self.rng.sample(deck, cards):
+            shoe[i] -= 1
+        return tuple(shoe)
+
+    #
+    # Draws count more compositions at every depth and records their
+    # advantage
+    #
+    # processes: size of the worker pool for the 'exact' method (None uses
+    #            every core, 1 runs in this process)
+    #
+    def sample(self, count, processes=None):
+        total = sum(self.shoe)
+        batch = [(depth, self.deal_down(round(depth*total)))
+            for depth in self.depths for _ in range(count)]
+        if self.method == 'linear':
+            values = {shoe: self.estimate(shoe) for _, shoe in batch}
+        else:
+            # identical compositions are only evaluated once
+            unique = list(dict.fromkeys(shoe for _, shoe in batch))
+            if processes == 1:
+                results = [advantage(shoe) for shoe in unique]
+            else:
+                with Pool(processes) as pool:
+                    results = pool.map(advantage, unique, chunksize=max(1, len(unique) // 64))
+            values = dict(zip(unique, results))
+        for depth, shoe in batch:
+            self.samples[depth].append(values[shoe])
+
+    #
+    # Returns a table of the advantage distribution (mean, standard
+    # deviation, 5/50/95th percentiles and fraction of positive samples) at
+    # every depth
+    #
+    def make_curve_table(self):
+        table = Table(float, CURVE_CODE, self.depths)
+        for depth, values in self.samples.items():
+            if not values:
+                continue
+            values = sorted(values)
+            mean = sum(values) / len(values)
+            table[depth, 'mean'] = mean
+            table[depth, 'sd'] = math.sqrt(sum((v - mean)**2 for v in values) / len(values))
+            table[depth, 'p05'] = percentile(values, .05)
+            table[depth, 'p50'] = percentile(values, .5)
+            table[depth, 'p95'] = percentile(values, .95)
+            table[depth, '>0'] = sum(1 for v in values if v > 0) / len(values)
+        return table
+
+
+if __name__ == "__main__":
+    import main
+    penetration = Penetration(6, [0., .25, .5, .75], method='linear', seed=0)
+    penetration.sample(1000)
+    main.print_2d_table('penetration', penetration.make_curve_table())
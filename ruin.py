@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+#
+# ruin.py
+#
+# Calculate the distribution of session results and the risk of ruin for
+# the game of Easy Blackjack over many rounds
+#
+
+import cmath
+import math
+from collections import defaultdict
+
+import easybj
+from easybj import (BUST, DISTINCT, SPLIT_CODE, draw, hand_code, hand_state, isclose, make_rules,
+    settle)
+from table import Table
+
+# most steps per bet tried when putting the payouts on an integer grid (a
+# 3:2 blackjack needs 2, a 6:5 blackjack 10)
+MAX_UNIT = 1000
+
+# bankrolls above the largest requested one are only tracked this many
+# standard deviations of the session swing; anything higher counts as safe
+RUIN_SIGMAS = 8
+
+# fft noise below this probability is dropped from session distributions
+FFT_EPSILON = 1e-15
+
+# smallest number of steps per bet that puts every payout on an integer grid
+def grid_unit(payouts):
+    for unit in range(1, MAX_UNIT + 1):
+        if all(isclose(p*unit, round(p*unit), abs_tol=1e-9) for p in payouts):
+            return unit
+    raise ValueError("payouts %s do not fit a grid of 1/%d bets"%(str(payouts), MAX_UNIT))
+
+# distribution of the sum of two independent nets
+def convolve(a, b):
+    result = defaultdict(float)
+    for x, p in a.items():
+        for y, q in b.items():
+            result[x + y] += p*q
+    return result
+
+#
+# In-place iterative radix-2 fast fourier transform (len(a) must be a power
+# of two)
+#
+def fft(a, invert=False):
+    n = len(a)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            a[i], a[j] = a[j], a[i]
+    length = 2
+    while length <= n:
+        w = cmath.exp((2j if invert else -2j)*math.pi/length)
+        half = length // 2
+        twiddle = [w**k for k in range(half)]
+        for start in range(0, n, length):
+            for k in range(half):
+                u = a[start + k]
+                v = a[start + k + half]*twiddle[k]
+                a[start + k] = u + v
+                a[start + k + half] = u - v
+        length <<= 1
+    if invert:
+        for i in range(n):
+            a[i] /= n
+    return a
+
+#
+# Builds the per-round distribution of net units from the ev tables of
+# easybj.calculate() and convolves it across many rounds
+#
+# results: dictionary returned by easybj.calculate()
+# spread: dictionary of bet size (whole units) to the fraction of rounds
+#         played at that bet
+# shoe: shoe the results were calculated for (None for an infinite deck)
+# rules: rules the results were calculated for (dictionary of changes to
+#        easybj.DEFAULT_RULES)
+#
+class Session:
+    def __init__(self, results, spread=None, shoe=None, rules=None):
+        self.results = results
+        self.rules = make_rules(rules)
+        # nets are counted in steps of 1/unit bets so that the blackjack and
+        # surrender payouts stay on an integer grid
+        payouts = [self.rules['blackjack']]
+        if self.rules['surrender'] is not None:
+            payouts.append(self.rules['surrender'])
+        self.unit = grid_unit(payouts)
+        # probability of drawing each DISTINCT card (same as the calculator)
+        self.probs = easybj.draw_probs(shoe)
+        self.spread = dict(spread) if spread else {1: 1.}
+        for bet, weight in self.spread.items():
+            if not isinstance(bet, int) or bet <= 0:
+                raise ValueError("bets must be positive whole units")
+            if weight < 0:
+                raise ValueError("bet weights must be non-negative")
+        # final (total, multiplier) distributions of a played hand
+        self.finals = {}
+        # net distributions of a split hand for every dealer final total
+        self.splits = {}
+        # net distribution (in steps of 1/unit bets) of a single round
+        self.roundprob = {}
+
+    # move to take once a hand has been hit (same rule as make_hit_table)
+    def continue_move(self, code, dealer):
+        stand = self.results['stand'][code, dealer]
+        return 'S' if stand >= self.results['hit'][code, dealer] else 'H'
+
+    # move taken by a hand that can no longer split (same as make_split0_table)
+    def split0_move(self, code, dealer):
+        if code == '21':
+            return 'S'
+        evs = [self.results['hit'][code, dealer],
+            self.results['stand'][code, dealer]]
+        if self.rules['das']:
+            evs.append(self.results['double'][code, dealer])
+        return 'HSD'[evs.index(max(evs))]
+
+    # distribution of (final total, bet multiplier) of a hand played by move
+    def play(self, total, soft, dealer, move):
+        key = (total, soft, dealer, move)
+        if key in self.finals:
+            return self.finals[key]
+        result = defaultdict(float)
+        if move == 'S':
+            result[total, 1] = 1.
+        else:
+            for card, p in zip(DISTINCT, self.probs):
+                new_total, new_soft = draw(total, soft, card)
+                if move == 'D':
+                    result[new_total, 2] += p
+                elif new_total == BUST or new_total == 21:
+                    result[new_total, 1] += p
+                else:
+                    code = hand_code(new_total, new_soft)
+                    next_move = self.continue_move(code, dealer)
+                    for k, q in self.play(new_total, new_soft, dealer, next_move).items():
+                        result[k] += p*q
+        self.finals[key] = result
+        return result
+
+    # net distribution of a played hand for every dealer final total
+    def settle_hand(self, finals, dealer):
+        result = {}
+        for final in self.results['dealer'][dealer]:
+            nets = defaultdict(float)
+            for (total, mult), p in finals.items():
+                nets[settle(total, mult, int(final))*self.unit] += p
+            result[final] = nets
+        return result
+
+    # net distribution of a post-split hand that can no longer split
+    def split0_hand(self, card, other, dealer):
+        total, soft = draw(*draw(0, False, card), other)
+        move = self.split0_move(hand_code(total, soft), dealer)
+        return self.settle_hand(self.play(total, soft, dealer, move), dealer)
+
+    # net distribution of a hand split into card, card (level 3 mirrors
+    # make_split3_table, level 2 make_split2_table, level 1 make_split1_table)
+    def split_hand(self, card, dealer, level):
+        key = (card, dealer, level)
+        if key in self.splits:
+            return self.splits[key]
+        result = {final: defaultdict(float) for final in self.results['dealer'][dealer]}
+        for c1, p1 in zip(DISTINCT, self.probs):
+            for c2, p2 in zip(DISTINCT, self.probs):
+                p = p1*p2
+                if card == 'A':
+                    hands = [self.settle_hand(self.play(*draw(11, True, c), dealer, 'S'), dealer)
+                        for c in (c1, c2)]
+                else:
+                    levels = [0, 0]
+                    if level == 3 and c1 == card and c2 == card:
+                        levels = [1, 1]
+                    elif level == 3 and c1 == card:
+                        levels = [2, 0]
+                    elif level == 3 and c2 == card:
+                        levels = [0, 2]
+                    elif level == 2 and c1 == card:
+                        levels = [1, 0]
+                    elif level == 2 and c2 == card:
+                        levels = [0, 1]
+                    hands = [self.split_hand(card, dealer, l) if l else self.split0_hand(card, c, dealer)
+                        for c, l in zip((c1, c2), levels)]
+                for final, nets in result.items():
+                    for net, q in convolve(hands[0][final], hands[1][final]).items():
+                        nets[net] += p*q
+        self.splits[key] = result
+        return result
+
+    # net distribution of a round for one unit bet on player code vs dealer
+    def make_round_cell(self, player, dealer):
+        if dealer == 'BJ':
+            return {0: 1.} if player == 'BJ' else {-self.unit: 1.}
+        if player == 'BJ':
+            return {round(self.rules['blackjack']*self.unit): 1.}
+        move = self.results['strategy'][player, dealer]
+        if move[0] == 'R':
+            return {round(self.rules['surrender']*self.unit): 1.}
+        if move == 'P':
+            hands = self.split_hand(player[0], dealer, 3)
+        else:
+            if player in SPLIT_CODE:
+                total, soft = draw(*draw(0, False, player[0]), player[1])
+            else:
+                total, soft = hand_state(player)
+            hands = self.settle_hand(self.play(total, soft, dealer, move[0]), dealer)
+        result = defaultdict(float)
+        for final, p in self.results['dealer'][dealer].items():
+            for net, q in hands[final].items():
+                result[net] += p*q
+        return result
+
+    # make the per-round net distribution (1/unit bets) for the bet spread
+    def make_round_table(self):
+        unit = defaultdict(float)
+        initial = self.results['initial']
+        for x in initial.xlabels:
+            for y in initial.ylabels:
+                for net, q in self.make_round_cell(y, x).items():
+                    unit[net] += initial[y,x]*q
+        total = sum(self.spread.values())
+        self.roundprob = defaultdict(float)
+        for bet, weight in self.spread.items():
+            for net, p in unit.items():
+                self.roundprob[net*bet] += p*weight/total
+
+    # verify the round distribution sums to 1 and matches the advantage
+    def verify_round_table(self):
+        total = sum(self.spread.values())
+        bet = sum(b*w for b, w in self.spread.items()) / total
+        mean = sum(net*p for net, p in self.roundprob.items()) / self.unit
+        assert(isclose(sum(self.roundprob.values())))
+        assert(isclose(mean, self.results['advantage']*bet))
+
+    #
+    # Returns the distribution of net units after each number of rounds
+    # (the round distribution is raised to the n-th power in fourier space
+    # so each round count costs one inverse transform)
+    #
+    def make_session_tables(self, rounds):
+        lo = min(self.roundprob)
+        width = max(self.roundprob) - lo
+        size = 1
+        while size < max(rounds)*width + 1:
+            size <<= 1
+        spectrum = [0j]*size
+        for net, p in self.roundprob.items():
+            spectrum[net - lo] += p
+        fft(spectrum)
+        sessions = {}
+        for n in rounds:
+            values = fft([z**n for z in spectrum], invert=True)
+            sessions[n] = {(n*lo + k) / self.unit: v.real
+                for k, v in enumerate(values[:n*width + 1]) if v.real > FFT_EPSILON}
+        return sessions
+
+    #
+    # Returns a table of the probability of going broke (bankroll at or
+    # below zero) within each number of rounds for each starting bankroll
+    #
+    # Ruin probabilities for every bankroll and every round count come out
+    # of one backward pass: ruin[n][b] = sum(p[x] * ruin[n-1][b+x])
+    #
+    def make_ruin_table(self, bankrolls, rounds):
+        table = Table(float, bankrolls, rounds, unit='%')
+        mean = sum(net*p for net, p in self.roundprob.items())
+        sigma = math.sqrt(sum((net - mean)**2*p for net, p in self.roundprob.items()))
+        loss = max(0, -min(self.roundprob))
+        gain = max(0, max(self.roundprob))
+        top = max(bankrolls)*self.unit + gain + math.ceil(RUIN_SIGMAS*sigma*math.sqrt(max(rounds)))
+        steps = sorted(self.roundprob.items())
+
+        # ruin[b] for bankroll b/unit bets, b = 0..top
+        ruin = [1.] + [0.]*top
+        for n in range(1, max(rounds) + 1):
+            padded = [1.]*loss + ruin + [0.]*gain
+            new = [0.]*top
+            for net, p in steps:
+                start = loss + 1 + net
+                new = [a + p*r for a, r in zip(new, padded[start:start + top])]
+            ruin = [1.] + new
+            if n in rounds:
+                for bankroll in bankrolls:
+                    table[n, bankroll] = min(1., ruin[bankroll*self.unit])
+        return table
+
+#
+# Calculate the round distribution, the session distributions and the risk
+# of ruin table and return them all in a dictionary
+#
+# bankrolls: starting bankrolls in units (x-labels of the ruin table)
+# rounds: numbers of rounds played (y-labels of the ruin table)
+# spread: dictionary of bet size to fraction of rounds (defaults to flat bet)
+# results: dictionary returned by easybj.calculate() (computed if missing)
+# shoe: shoe of the results (None for an infinite deck)
+# rules: rules of the results (dictionary of changes to easybj.DEFAULT_RULES)
+#
+def calculate(bankrolls, rounds, spread=None, results=None, shoe=None, rules=None):
+    for value in list(bankrolls) + list(rounds):
+        if not isinstance(value, int) or value <= 0:
+            raise ValueError("bankrolls and rounds must be positive integers")
+    if results is None:
+        results = easybj.calculate(shoe=shoe, rules=rules)
+    session = Session(results, spread, shoe, rules)
+    session.make_round_table()
+    session.verify_round_table()
+    return {
+        'round' : {net / session.unit: p for net, p in sorted(session.roundprob.items())},
+        'session' : session.make_session_tables(rounds),
+        'ruin' : session.make_ruin_table(bankrolls, rounds),
+    }
+
+
+if __name__ == "__main__":
+    import main
+    results = calculate([10, 25, 50, 100], [10, 100, 1000])
+    main.print_2d_table('ruin', results['ruin'])
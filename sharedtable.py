@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+#
+# sharedtable.py
+#
+# Implements a Table whose cells live in shared memory so that worker
+# processes can read and write them without copying
+#
+
+from multiprocessing import resource_tracker, shared_memory
+import math
+import struct
+
+from table import Table
+
+#
+# Table of floats stored in a multiprocessing.shared_memory block so that
+# many processes can read and write the same cells without copying
+#
+# Workers attach by name (see attach) and a SharedTable pickles as its name
+# and labels only, so passing one to a multiprocessing.Pool does not copy
+# the cells. Unset cells are stored as NaN and read back as None.
+#
+class SharedTable(Table):
+    #
+    # Initializes an instance of SharedTable class
+    #
+    # xlabels, ylabels, unit: same as Table
+    # name: name of an existing block to attach to (None creates a new one)
+    #
+    def __init__(self, celltype, xlabels, ylabels, unit="", name=None):
+        if celltype is not float:
+            raise TypeError("celltype of a shared table must be float")
+        self.celltype = celltype
+        self.xlabels = tuple(xlabels)
+        self.ylabels = tuple(ylabels)
+        self.unit = unit
+        size = struct.calcsize('d')*len(self.xlabels)*len(self.ylabels)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            # opening a block registers it with this process's resource
+            # tracker, which would unlink it when this process exits; only
+            # the creator may free it
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+            if self.shm.size < size:
+                self.shm.close()
+                self.shm = None
+                raise ValueError("shared block %s is too small for the labels"%name)
+        self.view = self.shm.buf[:size]
+        self.table = self.view.cast('d')
+        if self.owner:
+            for i in range(len(self.table)):
+                self.table[i] = math.nan
+        return
+
+    #
+    # Attaches to a shared table created by another process
+    #
+    @classmethod
+    def attach(cls, name, xlabels, ylabels, unit=""):
+        return cls(float, xlabels, ylabels, unit, name=name)
+
+    #
+    # Creates a shared table holding a copy of a float Table
+    #
+    @classmethod
+    def from_table(cls, table):
+        shared = cls(table.celltype, table.xlabels, table.ylabels, table.unit)
+        for y in table.ylabels:
+            for x in table.xlabels:
+                if table[y,x] is not None:
+                    shared[y,x] = table[y,x]
+        return shared
+
+    # name of the shared memory block
+    @property
+    def name(self):
+        return self.shm.name
+
+    # pickle as a reference to the block rather than its cells
+    def __reduce__(self):
+        return (SharedTable.attach, (self.name, self.xlabels, self.ylabels, self.unit))
+
+    # copies own a new block (a copy must not write into the original)
+    def __copy__(self):
+        return SharedTable.from_table(self)
+
+    def __deepcopy__(self, memo):
+        return SharedTable.from_table(self)
+
+    # "private" member function to find the flat index of a cell
+    def _offset(self, key):
+        row, col = self._validate_key(key)
+        return self.ylabels.index(row)*len(self.xlabels) + self.xlabels.index(col)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, self.celltype):
+            raise TypeError("value must be of type %s"%(self.celltype.__name__))
+        self.table[self._offset(key)] = value
+
+    def __getitem__(self, key):
+        value = self.table[self._offset(key)]
+        return None if math.isnan(value) else value
+
+    def __delitem__(self, key):
+        self.table[self._offset(key)] = math.nan
+
+    #
+    # Returns the values of column x (a slice of the table one worker can
+    # own, e.g. one dealer code)
+    #
+    def column(self, x):
+        return [self[y,x] for y in self.ylabels]
+
+    #
+    # Assigns the values of column x (values are in ylabels order)
+    #
+    def set_column(self, x, values):
+        if len(values) != len(self.ylabels):
+            raise ValueError("column must have exactly %d values"%len(self.ylabels))
+        for y, value in zip(self.ylabels, values):
+            self[y,x] = value
+
+    # "private" member function to release this process's mapping of the block
+    def _detach(self):
+        if getattr(self, 'shm', None) is None:
+            return False
+        self.table.release()
+        self.view.release()
+        self.shm.close()
+        return True
+
+    #
+    # Detaches this process from the block (the creator also frees it)
+    #
+    # A worker sharing the creator's resource tracker (e.g. a Pool worker)
+    # drops the creator's registration when it attaches, so the creator
+    # registers the block again before unlinking it (registering is
+    # idempotent). A block already removed by someone else is ignored.
+    #
+    def close(self):
+        if self._detach() and self.owner:
+            resource_tracker.register(self.shm._name, 'shared_memory')
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.shm = None
+
+    # detach when the table is garbage collected (the creator also frees it)
+    def __del__(self):
+        self.close()
@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+#
+# sidebet.py
+#
+# Calculate the exact house edge and variance of the side bets offered next
+# to Easy Blackjack (Perfect Pairs, 21+3 and Lucky Ladies) for an N-deck shoe
+#
+
+from itertools import product
+
+from easybj import NUM_RANKS
+from table import Table
+
+# all ranks of a French deck (T, J, Q, K all count 10 points)
+RANKS = 'A23456789TJQK'
+
+# all suits of a French deck (spades and clubs are black)
+SUITS = 'SHDC'
+BLACK = 'SC'
+
+#
+# Suit patterns of three ordered cards: each pattern lists which cards share
+# a suit, followed by the number of suit assignments that match it
+#
+SUIT_PATTERNS = [
+    ((0, 0, 0), 4),
+    ((0, 0, 1), 12),
+    ((0, 1, 0), 12),
+    ((0, 1, 1), 12),
+    ((0, 1, 2), 24),
+]
+
+# number of ways to draw k copies of a card with n copies in the shoe
+def falling(n, k):
+    result = 1
+    for i in range(k):
+        result *= n - i
+    return result
+
+# number of ordered ways to draw k cards from a shoe of decks
+def ordered(decks, k):
+    return falling(len(RANKS)*len(SUITS)*decks, k)
+
+#
+# Returns the probability of each winning Perfect Pairs outcome (player's
+# first two cards)
+#
+def perfect_pairs(decks):
+    cards = len(RANKS)*len(SUITS)
+    total = ordered(decks, 2)
+    return {
+        'perfect' : cards*falling(decks, 2) / total,
+        'coloured' : cards*(len(BLACK) - 1)*decks*decks / total,
+        'mixed' : cards*(len(SUITS) - len(BLACK))*decks*decks / total,
+    }
+
+# returns whether three ranks (indexes into RANKS) form a straight
+def is_straight(ranks):
+    ranks = sorted(ranks)
+    if ranks == [0, 11, 12]:
+        return True
+    return ranks[1] == ranks[0] + 1 and ranks[2] == ranks[1] + 1
+
+#
+# Returns the probability of each winning 21+3 outcome (player's first two
+# cards and the dealer's first card)
+#
+# Ordered rank triples are counted once per suit pattern instead of looping
+# over all 52^3 card triples
+#
+def twenty_one_plus_three(decks):
+    total = ordered(decks, 3)
+    result = dict.fromkeys(['suited trips', 'straight flush', 'three of a kind',
+        'straight', 'flush'], 0.)
+    for ranks in product(range(len(RANKS)), repeat=3):
+        trips = ranks[0] == ranks[1] == ranks[2]
+        straight = is_straight(ranks)
+        for pattern, ways in SUIT_PATTERNS:
+            flush = pattern == (0, 0, 0)
+            if not (trips or straight or flush):
+                continue
+            # identical cards (same rank and suit) come from the same copies
+            copies = {}
+            for card in zip(ranks, pattern):
+                copies[card] = copies.get(card, 0) + 1
+            count = ways
+            for k in copies.values():
+                count *= falling(decks, k)
+            if trips and flush:
+                outcome = 'suited trips'
+            elif straight and flush:
+                outcome = 'straight flush'
+            elif trips:
+                outcome = 'three of a kind'
+            elif straight:
+                outcome = 'straight'
+            else:
+                outcome = 'flush'
+            result[outcome] += count / total
+    return result
+
+#
+# Returns the probability of each winning Lucky Ladies outcome (player's
+# first two cards total 20; the top award also needs a dealer blackjack)
+#
+def lucky_ladies(decks):
+    total = ordered(decks, 2)
+    cards = len(RANKS)*len(SUITS)*decks
+    points = [11] + list(range(2, 10)) + [10]*4
+    result = dict.fromkeys(['queen hearts pair blackjack', 'queen hearts pair',
+        'matched 20', 'suited 20', 'unsuited 20'], 0.)
+    for r1, r2 in product(range(len(RANKS)), repeat=2):
+        if points[r1] + points[r2] != 20:
+            continue
+        if r1 == r2:
+            result['matched 20'] += len(SUITS)*falling(decks, 2) / total
+        else:
+            result['suited 20'] += len(SUITS)*decks*decks / total
+        result['unsuited 20'] += len(SUITS)*(len(SUITS) - 1)*decks*decks / total
+
+    # one of the matched suits is the queen of hearts pair
+    queens = falling(decks, 2) / total
+    result['matched 20'] -= queens
+    aces = len(SUITS)*decks
+    tens = 4*len(SUITS)*decks - 2
+    blackjack = 2*aces*tens / ((cards - 2)*(cards - 3))
+    result['queen hearts pair blackjack'] = queens*blackjack
+    result['queen hearts pair'] = queens*(1 - blackjack)
+    return result
+
+# outcome probabilities of every side bet
+SIDE_BETS = {
+    'perfect pairs' : perfect_pairs,
+    '21+3' : twenty_one_plus_three,
+    'lucky ladies' : lucky_ladies,
+}
+
+# common pay tables (paid to 1) of every side bet; any other outcome loses
+PAY_TABLES = {
+    'perfect pairs' : {
+        '25/12/6' : {'perfect': 25, 'coloured': 12, 'mixed': 6},
+        '30/10/5' : {'perfect': 30, 'coloured': 10, 'mixed': 5},
+        '25/10/5' : {'perfect': 25, 'coloured': 10, 'mixed': 5},
+    },
+    '21+3' : {
+        '9' : {'suited trips': 9, 'straight flush': 9, 'three of a kind': 9,
+            'straight': 9, 'flush': 9},
+        '100/40/30/10/5' : {'suited trips': 100, 'straight flush': 40,
+            'three of a kind': 30, 'straight': 10, 'flush': 5},
+        '30/40/30/10/5' : {'suited trips': 30, 'straight flush': 40,
+            'three of a kind': 30, 'straight': 10, 'flush': 5},
+    },
+    'lucky ladies' : {
+        '1000/200/25/10/4' : {'queen hearts pair blackjack': 1000,
+            'queen hearts pair': 200, 'matched 20': 25, 'suited 20': 10,
+            'unsuited 20': 4},
+        '1000/125/19/9/4' : {'queen hearts pair blackjack': 1000,
+            'queen hearts pair': 125, 'matched 20': 19, 'suited 20': 9,
+            'unsuited 20': 4},
+        '200/100/25/10/4' : {'queen hearts pair blackjack': 200,
+            'queen hearts pair': 100, 'matched 20': 25, 'suited 20': 10,
+            'unsuited 20': 4},
+    },
+}
+
+#
+# Returns a table of the house edge and variance (per unit bet) of every
+# pay table of a side bet
+#
+# probs: outcome probabilities returned by one of SIDE_BETS
+# pay_tables: dictionary of pay table name to {outcome: payout}
+#
+def make_edge_table(probs, pay_tables):
+    table = Table(float, ['edge', 'var'], pay_tables)
+    lose = 1 - sum(probs.values())
+    for name, pays in pay_tables.items():
+        for outcome in pays:
+            if outcome not in probs:
+                raise KeyError("%s is not an outcome of this bet"%outcome)
+        ev = sum(p*pays.get(outcome, -1) for outcome, p in probs.items()) - lose
+        ev2 = sum(p*pays.get(outcome, -1)**2 for outcome, p in probs.items()) + lose
+        table[name, 'edge'] = -ev
+        table[name, 'var'] = ev2 - ev*ev
+    return table
+
+#
+# Calculate the edge tables of every side bet and return them in a
+# dictionary (outcome probabilities are computed once per bet and shared by
+# all of its pay tables)
+#
+# decks: number of decks in the shoe
+# pay_tables: dictionary of bet name to its pay tables (see PAY_TABLES)
+#
+def calculate(decks, pay_tables=PAY_TABLES):
+    if not isinstance(decks, int) or decks <= 0:
+        raise ValueError("decks must be a positive integer")
+    assert(len(RANKS) == NUM_RANKS)
+    return {bet: make_edge_table(SIDE_BETS[bet](decks), tables)
+        for bet, tables in pay_tables.items()}
+
+
+if __name__ == "__main__":
+    import main
+    for bet, table in calculate(6).items():
+        main.print_2d_table(bet, table)
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+#
+# snapshot.py
+#
+# Build step that freezes the results of easybj.calculate() so that later
+# imports of easybj can answer without recomputing
+#
+# Note: rerun this file whenever easybj.py or table.py changes (a stale
+# snapshot is ignored and easybj falls back to computing)
+#
+
+import hashlib
+import os
+import pickle
+
+import easybj
+
+#
+# Computes the results and writes them after a (engine version, rules,
+# digest of the pickled results) header to path
+#
+# The snapshot is written to a temporary file and renamed into place, so a
+# crash never leaves a truncated snapshot behind a valid header
+#
+def write_snapshot(path=easybj.SNAPSHOT_PATH):
+    body = pickle.dumps(easybj.calculate(snapshot=False), protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha256(body).hexdigest()
+    temp = '%s.%d.tmp'%(path, os.getpid())
+    with open(temp, 'wb') as f:
+        pickle.dump((easybj.engine_version(), easybj.RULES, digest), f)
+        f.write(body)
+    os.replace(temp, path)
+
+
+if __name__ == "__main__":
+    write_snapshot()
+    print("wrote %s"%easybj.SNAPSHOT_PATH)